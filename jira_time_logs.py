@@ -1,7 +1,13 @@
-from jira import JIRA
+from jira import JIRA, Issue
+from requests.adapters import HTTPAdapter
+import aiohttp
+import asyncio
+import numpy as np
 import pandas as pd
-from datetime import datetime, date
+from datetime import datetime, date, time, timedelta, timezone
 import calendar
+import functools
+from collections import defaultdict
 import sys
 import re
 import argparse
@@ -12,6 +18,19 @@ except ImportError:
     print("Error: config.py file not found. Please create config.py with JIRA_URL, JIRA_EMAIL, and JIRA_API_TOKEN.")
     sys.exit(1)
 
+# Maximum number of worklog requests in flight at once
+CONCURRENT_REQUESTS = 8
+
+# Retries for worklog requests that fail to connect or that Jira rejects as rate limited or unavailable
+MAX_RETRIES = 5
+_RETRY_STATUSES = {429, 503}
+
+# Number of issues requested per page when searching
+SEARCH_PAGE_SIZE = 500
+
+# Pattern for the YYYY-MM date argument
+_DATE_RE = re.compile(r'^(\d{4})-(\d{2})$')
+
 def validate_date_format(date_str):
     """Validate the date string format (YYYY-MM) and return a tuple of (year, month)."""
     if date_str is None:
@@ -24,13 +43,11 @@ def validate_date_format(date_str):
         raise ValueError("Date string cannot be empty")
         
     # Basic format check
-    if not re.match(r'^\d{4}-\d{2}$', date_str):
+    match = _DATE_RE.match(date_str)
+    if not match:
         raise ValueError("Date must be in format YYYY-MM (e.g., 2024-03)")
     
-    try:
-        year, month = map(int, date_str.split('-'))
-    except (ValueError, TypeError):
-        raise ValueError("Date must be in format YYYY-MM (e.g., 2024-03)")
+    year, month = int(match.group(1)), int(match.group(2))
     
     # Check if year is reasonable (between 2000 and current year + 1)
     current_year = datetime.now().year
@@ -54,13 +71,78 @@ def get_month_range(year=None, month=None):
     last_day = date(year, month, calendar.monthrange(year, month)[1])
     return first_day, last_day
 
-def fetch_time_logs(target_date=None):
-    """Fetch time logs from Jira for the specified month or current month."""
-    # Connect to Jira
+def _epoch_millis(day):
+    """Return the start of the given day (UTC) as milliseconds since the epoch."""
+    return int(datetime.combine(day, time.min, tzinfo=timezone.utc).timestamp() * 1000)
+
+def _retry_delay(retry_after, attempt):
+    """Return the seconds to wait before a retry, honouring Retry-After and otherwise backing off exponentially."""
+    try:
+        return max(float(retry_after), 0)
+    except (TypeError, ValueError):
+        return 2 ** attempt
+
+async def _get_json(session, url, params):
+    """Get a JSON response, retrying with backoff while Jira is unreachable, rate limiting or unavailable."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with session.get(url, params=params) as response:
+                if response.status not in _RETRY_STATUSES or attempt == MAX_RETRIES:
+                    response.raise_for_status()
+                    return await response.json()
+                delay = _retry_delay(response.headers.get('Retry-After'), attempt)
+        except aiohttp.ClientConnectionError:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = _retry_delay(None, attempt)
+        await asyncio.sleep(delay)
+
+async def _fetch_worklogs(session, semaphore, issue_key, started_after, started_before):
+    """Fetch the worklogs for a single issue started within the given window, following pagination."""
+    url = f"{JIRA_URL.rstrip('/')}/rest/api/3/issue/{issue_key}/worklog"
+    params = {'startedAfter': started_after, 'startedBefore': started_before}
+    worklogs = []
+    start_at = 0
+    
+    async with semaphore:
+        while True:
+            page = await _get_json(session, url, {**params, 'startAt': start_at})
+            worklogs.extend(page['worklogs'])
+            start_at += len(page['worklogs'])
+            if not page['worklogs'] or start_at >= page.get('total', 0):
+                break
+    
+    return worklogs
+
+async def _fetch_all_worklogs(issue_keys, started_after, started_before):
+    """Fetch worklogs for all issues concurrently, preserving the order of issue_keys."""
+    semaphore = asyncio.Semaphore(CONCURRENT_REQUESTS)
+    auth = aiohttp.BasicAuth(JIRA_EMAIL, JIRA_API_TOKEN)
+    headers = {'Accept': 'application/json'}
+    
+    async with aiohttp.ClientSession(auth=auth, headers=headers) as session:
+        tasks = [
+            _fetch_worklogs(session, semaphore, key, started_after, started_before)
+            for key in issue_keys
+        ]
+        return await asyncio.gather(*tasks)
+
+@functools.lru_cache(maxsize=1)
+def _jira_client():
+    """Connect to Jira, reusing the client (and its pooled connections) across calls."""
     jira = JIRA(
         server=JIRA_URL,
-        basic_auth=(JIRA_EMAIL, JIRA_API_TOKEN)
+        basic_auth=(JIRA_EMAIL, JIRA_API_TOKEN),
+        default_batch_sizes={Issue: SEARCH_PAGE_SIZE}
     )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+    jira._session.mount('https://', adapter)
+    return jira
+
+def _iter_jira_time_logs(target_date=None):
+    """Yield (assignee, ticket number, ticket description, seconds) for each worklog in the month."""
+    # Connect to Jira
+    jira = _jira_client()
 
     # Get date range
     if target_date:
@@ -72,119 +154,193 @@ def fetch_time_logs(target_date=None):
     # Prepare the JQL query for worklogs in the target month
     jql_query = f'worklogDate >= "{start_date}" AND worklogDate <= "{end_date}"'
     
-    # Initialize lists to store data
-    time_logs = []
-    
-    # Search for issues with worklogs
-    issues = jira.search_issues(jql_query, maxResults=False)
+    # Search for issues with worklogs, fetching all pages but only the fields we need
+    issues = jira.search_issues(jql_query, fields='summary,worklog', maxResults=False)
     
+    # Use the worklogs returned inline with each issue when they are complete; Jira
+    # only includes the first 20, so the remaining issues are fetched separately
+    all_worklogs = []
+    truncated_keys = []
     for issue in issues:
-        # Get worklogs for each issue
-        worklogs = jira.worklogs(issue.key)
+        inline = issue.raw['fields'].get('worklog')
+        if inline and inline['total'] <= len(inline['worklogs']):
+            all_worklogs.append(inline['worklogs'])
+        else:
+            all_worklogs.append(None)
+            truncated_keys.append(issue.key)
+    
+    if truncated_keys:
+        # Let Jira filter worklogs by start time. The window is in UTC and padded by a
+        # day on each side, which covers every timezone the author's dates may be in
+        # (UTC-12 to UTC+14); the exact month check is still done below.
+        started_after = _epoch_millis(start_date - timedelta(days=1))
+        started_before = _epoch_millis(end_date + timedelta(days=2))
         
+        # Get worklogs for the truncated issues concurrently
+        fetched_worklogs = iter(asyncio.run(_fetch_all_worklogs(
+            truncated_keys, started_after, started_before
+        )))
+        all_worklogs = [
+            worklogs if worklogs is not None else next(fetched_worklogs)
+            for worklogs in all_worklogs
+        ]
+    
+    target_month = (start_date.year, start_date.month)
+    
+    for issue, worklogs in zip(issues, all_worklogs):
         for worklog in worklogs:
-            # Convert worklog date to datetime
-            worklog_date = datetime.strptime(worklog.started, "%Y-%m-%dT%H:%M:%S.%f%z").date()
+            # Take the year and month from the fixed-format ISO-8601 timestamp (YYYY-MM-DDTHH:MM:SS.sss+ZZZZ)
+            started = worklog['started']
             
             # Only include worklogs from target month
-            if start_date <= worklog_date <= end_date:
-                time_logs.append({
-                    'Assignee': worklog.author.displayName,
-                    'Ticket Number': issue.key,
-                    'Ticket Description': issue.fields.summary,
-                    'Hours Logged': worklog.timeSpentSeconds / 3600  # Convert seconds to hours
-                })
-    
-    return time_logs
+            if (int(started[:4]), int(started[5:7])) == target_month:
+                yield (
+                    worklog['author']['displayName'],
+                    issue.key,
+                    issue.fields.summary,
+                    worklog['timeSpentSeconds']
+                )
 
-def aggregate_time_logs(time_logs):
-    """Aggregate time logs by assignee and ticket."""
-    if not time_logs:
-        return []
+def fetch_time_logs(target_date=None):
+    """Fetch time logs from Jira for the specified month or current month."""
+    # Initialize one list per column to store data
+    assignees = []
+    ticket_numbers = []
+    ticket_descriptions = []
+    seconds_logged = []
     
-    # Create DataFrame
-    df = pd.DataFrame(time_logs)
+    for assignee, ticket_number, ticket_description, seconds in _iter_jira_time_logs(target_date):
+        assignees.append(assignee)
+        ticket_numbers.append(ticket_number)
+        ticket_descriptions.append(ticket_description)
+        seconds_logged.append(seconds)
     
-    # Group by assignee, ticket number, and ticket description, then sum the hours
-    aggregated_df = df.groupby(['Assignee', 'Ticket Number', 'Ticket Description'])['Hours Logged'].sum().reset_index()
+    return pd.DataFrame({
+        'Assignee': assignees,
+        'Ticket Number': ticket_numbers,
+        'Ticket Description': ticket_descriptions,
+        # Time is kept in whole seconds, as logged in Jira, until it is written out
+        'Seconds Logged': np.array(seconds_logged, dtype=np.int64)
+    })
+
+def _to_frame(time_logs):
+    """Return time logs as a DataFrame, accepting a DataFrame, a dict of columns or a list of records."""
+    if isinstance(time_logs, pd.DataFrame):
+        return time_logs
+    return pd.DataFrame(time_logs)
+
+def _iter_time_logs(time_logs):
+    """Yield (assignee, ticket number, ticket description, seconds) for each time log entry."""
+    if isinstance(time_logs, (pd.DataFrame, dict)):
+        return zip(
+            time_logs['Assignee'],
+            time_logs['Ticket Number'],
+            time_logs['Ticket Description'],
+            time_logs['Seconds Logged']
+        )
+    return (
+        (row['Assignee'], row['Ticket Number'], row['Ticket Description'], row['Seconds Logged'])
+        for row in time_logs
+    )
+
+def _aggregate_rows(rows):
+    """Sum the seconds of (assignee, ticket number, ticket description, seconds) rows into an aggregated DataFrame."""
+    totals = defaultdict(int)
+    for assignee, ticket_number, ticket_description, seconds in rows:
+        totals[(assignee, ticket_number, ticket_description)] += seconds
     
     # Sort by assignee and ticket number
-    aggregated_df = aggregated_df.sort_values(['Assignee', 'Ticket Number'])
+    totals = sorted(totals.items())
+    
+    # Store the key columns as categories so later rollups work on integer codes
+    return pd.DataFrame({
+        'Assignee': pd.Categorical([key[0] for key, _ in totals]),
+        'Ticket Number': pd.Categorical([key[1] for key, _ in totals]),
+        'Ticket Description': pd.Categorical([key[2] for key, _ in totals]),
+        'Seconds Logged': np.array([seconds for _, seconds in totals], dtype=np.int64)
+    })
+
+def aggregate_time_logs(time_logs):
+    """Aggregate time logs by assignee and ticket."""
+    return _aggregate_rows(_iter_time_logs(time_logs))
+
+def _to_hours(seconds):
+    """Convert seconds (a number, array or Series) to hours, rounded to 2 decimal places."""
+    return np.round(np.divide(seconds, 3600), 2)
+
+def _with_hours(df):
+    """Return a copy of df with its Seconds Logged column replaced by Hours Logged."""
+    df = df.copy()
+    df['Hours Logged'] = _to_hours(df.pop('Seconds Logged'))
+    return df
+
+def _column_widths(df):
+    """Return the width of each column of df, fitting its header and longest value plus some padding."""
+    max_lengths = df.astype(str).apply(lambda column: column.str.len().max())
+    return [max(length, len(str(name))) + 2 for name, length in max_lengths.items()]
+
+def _hours_by_person(df):
+    """Total the hours in aggregated time logs by person, sorted by name."""
+    # Map each person to an integer code and sum the seconds per code in one pass
+    codes, names = pd.factorize(df['Assignee'], sort=True)
+    seconds = np.bincount(codes, weights=df['Seconds Logged'].to_numpy(), minlength=len(names))
+    return pd.Series(_to_hours(seconds), index=pd.Index(names, name='Assignee'), name='Hours Logged')
+
+def _hours_by_ticket(df):
+    """Total the hours in aggregated time logs by ticket, sorted by description."""
+    # Map each ticket to an integer code and sum the seconds per code in one pass
+    codes, tickets = pd.factorize(df['Ticket Number'])
+    seconds = np.bincount(codes, weights=df['Seconds Logged'].to_numpy(), minlength=len(tickets))
     
-    # Round hours to 2 decimal places
-    aggregated_df['Hours Logged'] = aggregated_df['Hours Logged'].round(2)
+    # Every row of a ticket has the same description, so take it from the ticket's first row
+    _, first_rows = np.unique(codes, return_index=True)
+    descriptions = df['Ticket Description'].to_numpy()[first_rows]
     
-    return aggregated_df.to_dict('records')
+    index = pd.MultiIndex.from_arrays([tickets, descriptions], names=['Ticket Number', 'Ticket Description'])
+    by_ticket = pd.Series(_to_hours(seconds), index=index, name='Hours Logged')
+    return by_ticket.sort_index(level='Ticket Description')
+
+def _base_filename(target_date=None):
+    """Generate the output filename, without extension, for the target month and year or current date."""
+    if target_date:
+        year, month = validate_date_format(target_date)
+        return f"{OUTPUT_FILENAME_PREFIX}_{year}_{month:02d}"
+    current_date = datetime.now()
+    return f"{OUTPUT_FILENAME_PREFIX}_{current_date.strftime('%Y_%m')}"
 
 def save_time_logs(time_logs, target_date=None, output_format='csv'):
     """Save time logs to a file in the specified format (csv or excel)."""
-    if not time_logs:
+    df = _to_frame(time_logs)
+    if df.empty:
         print("No time logs found for the specified month.")
         return
     
-    # Create DataFrame
-    df = pd.DataFrame(time_logs)
-    
-    # Generate filename with target month and year or current date
-    if target_date:
-        year, month = validate_date_format(target_date)
-        base_filename = f"{OUTPUT_FILENAME_PREFIX}_{year}_{month:02d}"
-    else:
-        current_date = datetime.now()
-        base_filename = f"{OUTPUT_FILENAME_PREFIX}_{current_date.strftime('%Y_%m')}"
+    base_filename = _base_filename(target_date)
     
     # Save to file based on format
     if output_format.lower() == 'excel':
         filename = f"{base_filename}.xlsx"
         
+        # Contents of each sheet, with any index written as leading columns
+        sheets = {
+            'Time Logs': _with_hours(df),
+            'Hours by Person': _hours_by_person(df).reset_index(),
+            'Hours by Ticket': _hours_by_ticket(df).reset_index()
+        }
+        
         # Create Excel writer
-        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-            # Save main data to first sheet
-            df.to_excel(writer, sheet_name='Time Logs', index=False)
-            
-            # Create pivot table for hours by person
-            pivot_by_person = df.pivot_table(
-                values='Hours Logged',
-                index='Assignee',
-                aggfunc='sum'
-            ).round(2)
-            pivot_by_person = pivot_by_person.sort_index()  # Sort by name
-            pivot_by_person.to_excel(writer, sheet_name='Hours by Person')
-            
-            # Create pivot table for hours by ticket
-            pivot_by_ticket = df.pivot_table(
-                values='Hours Logged',
-                index=['Ticket Number', 'Ticket Description'],
-                aggfunc='sum'
-            ).round(2)
-            pivot_by_ticket = pivot_by_ticket.sort_values('Ticket Description')  # Sort by description
-            pivot_by_ticket.to_excel(writer, sheet_name='Hours by Ticket')
-            
-            # Adjust column widths for all sheets
-            for sheet_name in writer.sheets:
-                worksheet = writer.sheets[sheet_name]
+        with pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
+            for sheet_name, sheet_df in sheets.items():
+                sheet_df.to_excel(writer, sheet_name=sheet_name, index=False)
                 
-                # Get the maximum length of content in each column
-                for idx, col in enumerate(worksheet.columns):
-                    # Get the maximum length of content in the column
-                    max_length = 0
-                    column = [cell for cell in col]
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    
-                    # Add some padding to the max length
-                    adjusted_width = (max_length + 2)
-                    
-                    # Set the column width
-                    worksheet.column_dimensions[chr(65 + idx)].width = adjusted_width
+                # Adjust column widths to fit the content
+                worksheet = writer.sheets[sheet_name]
+                for idx, width in enumerate(_column_widths(sheet_df)):
+                    worksheet.set_column(idx, idx, width)
             
     else:  # default to csv
         filename = f"{base_filename}.csv"
-        df.to_csv(filename, index=False)
+        _with_hours(df).to_csv(filename, index=False)
     
     print(f"Time logs have been saved to {filename}")
 
@@ -202,9 +358,9 @@ def main():
             validate_date_format(args.date)
         
         print(f"Fetching time logs from Jira for {'specified month' if args.date else 'current month'}...")
-        time_logs = fetch_time_logs(args.date)
         print("Aggregating time logs...")
-        aggregated_logs = aggregate_time_logs(time_logs)
+        # Aggregate worklog rows as they are yielded, without collecting them in a DataFrame first
+        aggregated_logs = _aggregate_rows(_iter_jira_time_logs(args.date))
         save_time_logs(aggregated_logs, args.date, args.format)
     except ValueError as e:
         print(f"Error: {str(e)}")
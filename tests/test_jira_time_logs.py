@@ -1,12 +1,19 @@
 import pytest
-from datetime import datetime, date
+import asyncio
+import sys
+from datetime import datetime, date, timezone
 import pandas as pd
-from unittest.mock import Mock, patch
+from openpyxl import load_workbook
+from unittest.mock import Mock, MagicMock, AsyncMock, patch
 from jira_time_logs import (
     get_month_range,
     aggregate_time_logs,
     save_time_logs,
-    validate_date_format
+    validate_date_format,
+    main,
+    _hours_by_person,
+    _hours_by_ticket,
+    _with_hours
 )
 
 # Test data
@@ -15,19 +22,19 @@ MOCK_TIME_LOGS = [
         'Assignee': 'John Doe',
         'Ticket Number': 'TR-123',
         'Ticket Description': 'Test Ticket 1',
-        'Hours Logged': 2.5
+        'Seconds Logged': 9000  # 2.5 hours
     },
     {
         'Assignee': 'John Doe',
         'Ticket Number': 'TR-123',
         'Ticket Description': 'Test Ticket 1',
-        'Hours Logged': 1.5
+        'Seconds Logged': 5400  # 1.5 hours
     },
     {
         'Assignee': 'Jane Smith',
         'Ticket Number': 'TR-456',
         'Ticket Description': 'Test Ticket 2',
-        'Hours Logged': 3.0
+        'Seconds Logged': 10800  # 3 hours
     }
 ]
 
@@ -104,11 +111,12 @@ def test_get_month_range_specific():
 def test_aggregate_time_logs_empty():
     """Test aggregation with empty time logs."""
     result = aggregate_time_logs([])
-    assert result == []
+    assert result.empty
+    assert list(result.columns) == ['Assignee', 'Ticket Number', 'Ticket Description', 'Seconds Logged']
 
 def test_aggregate_time_logs():
     """Test that time logs are correctly aggregated by assignee and ticket."""
-    result = aggregate_time_logs(MOCK_TIME_LOGS)
+    result = aggregate_time_logs(MOCK_TIME_LOGS).to_dict('records')
     
     # Should have 2 entries after aggregation (2 unique assignee-ticket combinations)
     assert len(result) == 2
@@ -116,55 +124,123 @@ def test_aggregate_time_logs():
     # Find John Doe's entry
     john_entry = next(entry for entry in result if entry['Assignee'] == 'John Doe')
     assert john_entry['Ticket Number'] == 'TR-123'
-    assert john_entry['Hours Logged'] == 4.0  # 2.5 + 1.5
+    assert john_entry['Seconds Logged'] == 14400  # 2.5 + 1.5 hours
     
     # Find Jane Smith's entry
     jane_entry = next(entry for entry in result if entry['Assignee'] == 'Jane Smith')
     assert jane_entry['Ticket Number'] == 'TR-456'
-    assert jane_entry['Hours Logged'] == 3.0
+    assert jane_entry['Seconds Logged'] == 10800
+
+def test_aggregate_time_logs_columns():
+    """Test that aggregation accepts time logs as columns or as a DataFrame."""
+    columns = {key: [entry[key] for entry in MOCK_TIME_LOGS] for key in MOCK_TIME_LOGS[0]}
+    
+    expected = aggregate_time_logs(MOCK_TIME_LOGS)
+    pd.testing.assert_frame_equal(aggregate_time_logs(columns), expected)
+    pd.testing.assert_frame_equal(aggregate_time_logs(pd.DataFrame(columns)), expected)
+    assert aggregate_time_logs(pd.DataFrame({key: [] for key in columns})).empty
+
+def test_aggregate_time_logs_seconds():
+    """Test that seconds are summed exactly and only converted to hours on output."""
+    time_logs = pd.DataFrame({
+        'Assignee': ['John Doe'] * 3,
+        'Ticket Number': ['TR-123'] * 3,
+        'Ticket Description': ['Test Ticket 1'] * 3,
+        'Seconds Logged': [1200] * 3  # 20 minutes each
+    })
+    
+    result = aggregate_time_logs(time_logs)
+    assert result['Seconds Logged'].dtype == 'int64'
+    assert result['Seconds Logged'].tolist() == [3600]
+    assert _with_hours(result)['Hours Logged'].tolist() == [1.0]
 
 def test_aggregate_time_logs_sorting():
     """Test that aggregated results are sorted by assignee and ticket number."""
     result = aggregate_time_logs(MOCK_TIME_LOGS)
     
     # Check that results are sorted by assignee name
-    assignees = [entry['Assignee'] for entry in result]
+    assignees = list(result['Assignee'])
     assert assignees == sorted(assignees)
 
 @patch('pandas.DataFrame.to_csv')
-@patch('pandas.ExcelWriter')
-def test_save_time_logs_excel(mock_excel_writer, mock_to_csv):
+def test_save_time_logs_excel(mock_to_csv, tmp_path, monkeypatch):
     """Test saving to Excel format with multiple sheets."""
-    # Setup mock ExcelWriter
-    mock_writer = Mock()
-    mock_excel_writer.return_value.__enter__.return_value = mock_writer
-    
-    # Setup mock worksheet
-    mock_worksheet = Mock()
-    mock_worksheet.columns = [[Mock(value='Header1'), Mock(value='LongValue1')],
-                            [Mock(value='Header2'), Mock(value='LongValue2')]]
-    mock_writer.sheets = {'Sheet1': mock_worksheet}
-    
-    save_time_logs(MOCK_TIME_LOGS, output_format='excel')
+    monkeypatch.chdir(tmp_path)
     
-    # Verify ExcelWriter was created
-    mock_excel_writer.assert_called_once()
+    save_time_logs(aggregate_time_logs(MOCK_TIME_LOGS), "2024-03", output_format='excel')
     
     # Verify all three sheets were written
-    assert mock_writer.to_excel.call_count == 3
+    workbook = load_workbook(tmp_path / "jira_time_logs_2024_03.xlsx")
+    assert workbook.sheetnames == ['Time Logs', 'Hours by Person', 'Hours by Ticket']
     
-    # Get all sheet names that were written
-    sheet_calls = [call[1]['sheet_name'] for call in mock_writer.to_excel.call_args_list]
-    assert 'Time Logs' in sheet_calls
-    assert 'Hours by Person' in sheet_calls
-    assert 'Hours by Ticket' in sheet_calls
+    # Verify the pivot sheets hold the totals
+    by_person = list(workbook['Hours by Person'].values)
+    assert by_person == [('Assignee', 'Hours Logged'), ('Jane Smith', 3), ('John Doe', 4)]
+    by_ticket = list(workbook['Hours by Ticket'].values)
+    assert by_ticket[1:] == [('TR-123', 'Test Ticket 1', 4), ('TR-456', 'Test Ticket 2', 3)]
     
-    # Verify column width adjustment was attempted
-    assert mock_worksheet.column_dimensions.__setitem__.call_count > 0
+    # Verify column widths fit the longest value or header (the stored width includes cell padding)
+    worksheet = workbook['Time Logs']
+    assert int(worksheet.column_dimensions['A'].width) == len('Jane Smith') + 2
+    assert int(worksheet.column_dimensions['D'].width) == len('Hours Logged') + 2
     
     # Verify CSV was not called
     mock_to_csv.assert_not_called()
 
+def test_save_time_logs_excel_ticket_order(tmp_path, monkeypatch):
+    """Test that the hours by ticket sheet is sorted by ticket description."""
+    monkeypatch.chdir(tmp_path)
+    time_logs = [
+        {'Assignee': 'Jane Smith', 'Ticket Number': 'TR-1', 'Ticket Description': 'Zeta', 'Seconds Logged': 3600},
+        {'Assignee': 'Jane Smith', 'Ticket Number': 'TR-2', 'Ticket Description': 'Alpha', 'Seconds Logged': 7200},
+        {'Assignee': 'John Doe', 'Ticket Number': 'TR-3', 'Ticket Description': 'Beta', 'Seconds Logged': 10800}
+    ]
+    
+    save_time_logs(aggregate_time_logs(time_logs), "2024-03", output_format='excel')
+    
+    workbook = load_workbook(tmp_path / "jira_time_logs_2024_03.xlsx")
+    descriptions = [row[1] for row in workbook['Hours by Ticket'].values][1:]
+    assert descriptions == ['Alpha', 'Beta', 'Zeta']
+
+def test_hours_by_ticket():
+    """Test that ticket totals include every person who logged time on the ticket."""
+    time_logs = MOCK_TIME_LOGS + [
+        {'Assignee': 'Jane Smith', 'Ticket Number': 'TR-123', 'Ticket Description': 'Test Ticket 1', 'Seconds Logged': 1800}
+    ]
+    
+    # One row per person on each ticket, sorted by description
+    result = _hours_by_ticket(aggregate_time_logs(time_logs + [
+        {'Assignee': 'John Doe', 'Ticket Number': 'TR-001', 'Ticket Description': 'Test Ticket 3', 'Seconds Logged': 3600}
+    ]))
+    assert list(result.index.names) == ['Ticket Number', 'Ticket Description']
+    assert list(result.items()) == [
+        (('TR-123', 'Test Ticket 1'), 4.5),
+        (('TR-456', 'Test Ticket 2'), 3.0),
+        (('TR-001', 'Test Ticket 3'), 1.0)
+    ]
+    
+    # One person on each ticket
+    result = _hours_by_ticket(aggregate_time_logs(MOCK_TIME_LOGS))
+    assert result.to_dict() == {('TR-123', 'Test Ticket 1'): 4.0, ('TR-456', 'Test Ticket 2'): 3.0}
+
+def test_rollups_round_exact_totals():
+    """Test that rollups round each exact total rather than summing rounded rows."""
+    time_logs = [
+        {'Assignee': 'John Doe', 'Ticket Number': 'TR-1', 'Ticket Description': 'Test Ticket 1', 'Seconds Logged': 20},
+        {'Assignee': 'John Doe', 'Ticket Number': 'TR-2', 'Ticket Description': 'Test Ticket 2', 'Seconds Logged': 20},
+        {'Assignee': 'John Doe', 'Ticket Number': 'TR-3', 'Ticket Description': 'Test Ticket 3', 'Seconds Logged': 20},
+        {'Assignee': 'Jane Smith', 'Ticket Number': 'TR-1', 'Ticket Description': 'Test Ticket 1', 'Seconds Logged': 20},
+        {'Assignee': 'Amy Lee', 'Ticket Number': 'TR-1', 'Ticket Description': 'Test Ticket 1', 'Seconds Logged': 20}
+    ]
+    aggregated = aggregate_time_logs(time_logs)
+    
+    # Each row rounds 20 seconds (0.0056 hours) up to 0.01
+    assert set(_with_hours(aggregated)['Hours Logged']) == {0.01}
+    
+    # 60 seconds is 0.0167 hours, so the totals are 0.02, not the 0.03 the rounded rows add up to
+    assert _hours_by_person(aggregated)['John Doe'] == 0.02
+    assert _hours_by_ticket(aggregated)[('TR-1', 'Test Ticket 1')] == 0.02
+
 @patch('pandas.DataFrame.to_csv')
 @patch('pandas.ExcelWriter')
 def test_save_time_logs_current_month(mock_excel_writer, mock_to_csv):
@@ -194,40 +270,199 @@ def test_save_time_logs_empty(mock_excel_writer, mock_to_csv):
     mock_to_csv.assert_not_called()
     mock_excel_writer.assert_not_called()
 
+@patch('jira_time_logs._iter_jira_time_logs')
+def test_main_csv(mock_iter_time_logs, tmp_path, monkeypatch):
+    """Test that the CSV output aggregates fetched rows the same way as aggregate_time_logs."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['jira_time_logs.py', '--date', '2024-03'])
+    mock_iter_time_logs.return_value = iter([
+        (entry['Assignee'], entry['Ticket Number'], entry['Ticket Description'], entry['Seconds Logged'])
+        for entry in MOCK_TIME_LOGS
+    ])
+    
+    main()
+    written = (tmp_path / "jira_time_logs_2024_03.csv").read_text()
+    
+    save_time_logs(aggregate_time_logs(MOCK_TIME_LOGS), "2024-03")
+    assert written == (tmp_path / "jira_time_logs_2024_03.csv").read_text()
+
+@patch('jira_time_logs._iter_jira_time_logs')
+def test_main_csv_rounding(mock_iter_time_logs, tmp_path, monkeypatch):
+    """Test that the CSV output rounds hours the same way as the other outputs."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['jira_time_logs.py', '--date', '2024-03'])
+    mock_iter_time_logs.return_value = iter([('John Doe', 'TR-123', 'Test Ticket 1', 54)])
+    
+    main()
+    
+    lines = (tmp_path / "jira_time_logs_2024_03.csv").read_text().splitlines()
+    assert lines[1] == 'John Doe,TR-123,Test Ticket 1,0.02'  # 0.015 hours
+
+@patch('jira_time_logs._iter_jira_time_logs')
+def test_main_csv_empty(mock_iter_time_logs, tmp_path, monkeypatch):
+    """Test that no CSV file is created when there are no time logs."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['jira_time_logs.py', '--date', '2024-03'])
+    mock_iter_time_logs.return_value = iter([])
+    
+    main()
+    assert not (tmp_path / "jira_time_logs_2024_03.csv").exists()
+
+@patch('jira_time_logs.fetch_time_logs')
+@patch('jira_time_logs._iter_jira_time_logs')
+def test_main_excel(mock_iter_time_logs, mock_fetch_time_logs, tmp_path, monkeypatch):
+    """Test that the Excel output aggregates fetched rows without a per-worklog DataFrame."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['jira_time_logs.py', '--date', '2024-03', '--format', 'excel'])
+    mock_iter_time_logs.return_value = iter([('John Doe', 'TR-123', 'Test Ticket 1', 3600)])
+    
+    main()
+    
+    mock_fetch_time_logs.assert_not_called()
+    workbook = load_workbook(tmp_path / "jira_time_logs_2024_03.xlsx")
+    assert list(workbook['Time Logs'].values)[1] == ('John Doe', 'TR-123', 'Test Ticket 1', 1)
+
 @pytest.fixture
 def mock_jira():
     """Fixture to create a mock Jira instance."""
     mock_issue = Mock()
     mock_issue.key = 'TR-123'
     mock_issue.fields.summary = 'Test Ticket'
-    
-    mock_worklog = Mock()
-    mock_worklog.author.displayName = 'Test User'
-    mock_worklog.started = '2024-03-15T10:00:00.000+0000'
-    mock_worklog.timeSpentSeconds = 3600  # 1 hour
-    
-    mock_issue.worklogs.return_value = [mock_worklog]
+    # More worklogs exist than Jira returned inline
+    mock_issue.raw = {'fields': {'worklog': {'total': 25, 'worklogs': []}}}
     
     mock_jira = Mock()
     mock_jira.search_issues.return_value = [mock_issue]
-    mock_jira.worklogs.return_value = [mock_worklog]
     
     return mock_jira
 
+@pytest.fixture
+def mock_worklog():
+    """Fixture to create a worklog as returned by the Jira REST API."""
+    return {
+        'author': {'displayName': 'Test User'},
+        'started': '2024-03-15T10:00:00.000+0000',
+        'timeSpentSeconds': 3600  # 1 hour
+    }
+
+@patch('jira_time_logs._fetch_worklogs', new_callable=AsyncMock)
 @patch('jira_time_logs.JIRA')
-def test_fetch_time_logs(mock_jira_class, mock_jira):
+def test_fetch_time_logs(mock_jira_class, mock_fetch_worklogs, mock_jira, mock_worklog):
     """Test that fetch_time_logs correctly processes Jira data."""
     mock_jira_class.return_value = mock_jira
+    outside_worklog = dict(mock_worklog, started='2024-02-29T23:00:00.000+0000')
+    mock_fetch_worklogs.return_value = [mock_worklog, outside_worklog]
     
-    from jira_time_logs import fetch_time_logs
+    from jira_time_logs import fetch_time_logs, _jira_client
+    _jira_client.cache_clear()
     
     # Test with specific date
     result = fetch_time_logs("2024-03")
     
-    # Verify the result structure
+    # Verify only the needed fields were requested, without capping the result count
+    mock_jira.search_issues.assert_called_once()
+    assert mock_jira.search_issues.call_args[1]['fields'] == 'summary,worklog'
+    assert mock_jira.search_issues.call_args[1]['maxResults'] is False
+    
+    # Verify worklogs were requested for the issue, filtered to a window around the month
+    args = mock_fetch_worklogs.call_args[0]
+    assert args[2] == 'TR-123'
+    assert args[3] == datetime(2024, 2, 29, tzinfo=timezone.utc).timestamp() * 1000
+    assert args[4] == datetime(2024, 4, 2, tzinfo=timezone.utc).timestamp() * 1000
+    
+    # Verify the result structure, excluding the worklog from outside the month
+    assert list(result.columns) == ['Assignee', 'Ticket Number', 'Ticket Description', 'Seconds Logged']
     assert len(result) == 1
-    entry = result[0]
+    entry = result.iloc[0]
     assert entry['Assignee'] == 'Test User'
     assert entry['Ticket Number'] == 'TR-123'
     assert entry['Ticket Description'] == 'Test Ticket'
-    assert entry['Hours Logged'] == 1.0  # 3600 seconds = 1 hour 
\ No newline at end of file
+    assert entry['Seconds Logged'] == 3600
+    
+    # Verify the Jira client is reused by later calls
+    fetch_time_logs("2024-03")
+    mock_jira_class.assert_called_once()
+    _jira_client.cache_clear()
+
+@patch('jira_time_logs._fetch_worklogs', new_callable=AsyncMock)
+@patch('jira_time_logs.JIRA')
+def test_fetch_time_logs_inline_worklogs(mock_jira_class, mock_fetch_worklogs, mock_jira, mock_worklog):
+    """Test that complete inline worklogs are used without fetching them separately."""
+    mock_jira_class.return_value = mock_jira
+    mock_issue = mock_jira.search_issues.return_value[0]
+    mock_issue.raw = {'fields': {'worklog': {'total': 1, 'worklogs': [mock_worklog]}}}
+    
+    from jira_time_logs import fetch_time_logs, _jira_client
+    _jira_client.cache_clear()
+    
+    result = fetch_time_logs("2024-03")
+    _jira_client.cache_clear()
+    
+    mock_fetch_worklogs.assert_not_called()
+    assert len(result) == 1
+    assert result.iloc[0]['Seconds Logged'] == 3600
+
+def test_fetch_worklogs_pagination(mock_worklog):
+    """Test that _fetch_worklogs follows pagination until all worklogs are fetched."""
+    from jira_time_logs import _fetch_worklogs
+    
+    pages = [
+        {'startAt': 0, 'total': 3, 'worklogs': [mock_worklog, mock_worklog]},
+        {'startAt': 2, 'total': 3, 'worklogs': [mock_worklog]}
+    ]
+    responses = []
+    for page in pages:
+        response = MagicMock(status=200)
+        response.json = AsyncMock(return_value=page)
+        responses.append(response)
+    
+    mock_session = MagicMock()
+    mock_session.get.return_value.__aenter__.side_effect = responses
+    
+    result = asyncio.run(_fetch_worklogs(mock_session, asyncio.Semaphore(1), 'TR-123', 1000, 2000))
+    
+    assert len(result) == 3
+    assert mock_session.get.call_count == 2
+    params = mock_session.get.call_args_list[1][1]['params']
+    assert params == {'startedAfter': 1000, 'startedBefore': 2000, 'startAt': 2}
+
+@patch('jira_time_logs.asyncio.sleep', new_callable=AsyncMock)
+def test_fetch_worklogs_retry(mock_sleep, mock_worklog):
+    """Test that rate limited worklog requests are retried after the Retry-After delay."""
+    from jira_time_logs import _fetch_worklogs
+    
+    rate_limited = MagicMock(status=429, headers={'Retry-After': '3'})
+    unavailable = MagicMock(status=503, headers={})
+    ok = MagicMock(status=200)
+    ok.json = AsyncMock(return_value={'startAt': 0, 'total': 1, 'worklogs': [mock_worklog]})
+    
+    mock_session = MagicMock()
+    mock_session.get.return_value.__aenter__.side_effect = [rate_limited, unavailable, ok]
+    
+    result = asyncio.run(_fetch_worklogs(mock_session, asyncio.Semaphore(1), 'TR-123', 1000, 2000))
+    
+    assert result == [mock_worklog]
+    assert mock_session.get.call_count == 3
+    rate_limited.raise_for_status.assert_not_called()
+    # Retry-After is honoured, otherwise the delay backs off exponentially
+    assert [call[0][0] for call in mock_sleep.call_args_list] == [3.0, 2]
+
+@patch('jira_time_logs.JIRA_URL', 'https://example.atlassian.net/')
+@patch('jira_time_logs.asyncio.sleep', new_callable=AsyncMock)
+def test_fetch_worklogs_connection_error(mock_sleep, mock_worklog):
+    """Test that worklog requests are retried after a connection error."""
+    import aiohttp
+    from jira_time_logs import _fetch_worklogs
+    
+    ok = MagicMock(status=200)
+    ok.json = AsyncMock(return_value={'startAt': 0, 'total': 1, 'worklogs': [mock_worklog]})
+    
+    mock_session = MagicMock()
+    mock_session.get.return_value.__aenter__.side_effect = [aiohttp.ClientConnectionError(), ok]
+    
+    result = asyncio.run(_fetch_worklogs(mock_session, asyncio.Semaphore(1), 'TR-123', 1000, 2000))
+    
+    assert result == [mock_worklog]
+    assert [call[0][0] for call in mock_sleep.call_args_list] == [1]
+    # A trailing slash on JIRA_URL does not produce a double slash in the request path
+    assert mock_session.get.call_args[0][0] == 'https://example.atlassian.net/rest/api/3/issue/TR-123/worklog'